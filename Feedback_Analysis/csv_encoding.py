@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CSV 文件编码识别（feedback_classifier 与 stats_plot 共用）
+
+- detect_encoding：用 charset-normalizer 检测文件开头样本
+- can_decode：按块流式解码整个文件验证编码，不在内存中保留解码结果
+- resolve_encoding：检测 + 全文验证，失败时依次尝试常见编码
+"""
+
+from __future__ import annotations
+
+import codecs
+from typing import List
+
+import charset_normalizer
+
+# 检测失败或验证不通过时依次尝试的常见编码
+ENCODING_CANDIDATES: List[str] = ["utf-8", "utf-8-sig", "gb18030", "gbk", "cp936"]
+
+
+def detect_encoding(path: str, sample_size: int = 65536) -> str | None:
+    """读取文件开头一段检测编码；检测失败返回 None"""
+    with open(path, "rb") as f:
+        raw = f.read(sample_size)
+    # 截断到最后一个换行，避免把被切开的多字节字符误判为其他编码
+    cut = raw.rfind(b"\n")
+    if cut > 0:
+        raw = raw[:cut + 1]
+    best = charset_normalizer.from_bytes(raw).best()
+    return best.encoding if best is not None else None
+
+
+def can_decode(path: str, encoding: str, block_size: int = 1 << 20) -> bool:
+    """按块流式解码整个文件，判断能否用 encoding 完整解码"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    try:
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                decoder.decode(block)
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def resolve_encoding(path: str) -> str:
+    """
+    确定整个文件的编码：先用开头样本检测，再对全文验证，失败时依次尝试常见编码。
+    样本全为 ASCII 时检测结果只能说明开头是 ASCII，改为先试 UTF-8 再试 GB18030。
+    """
+    detected = detect_encoding(path)
+    if detected is not None and codecs.lookup(detected).name == "ascii":
+        detected = None
+    candidates = ([detected] if detected else []) + ENCODING_CANDIDATES
+    tried: set[str] = set()
+    for enc in candidates:
+        name = codecs.lookup(enc).name
+        if name in tried:
+            continue
+        tried.add(name)
+        if can_decode(path, enc):
+            return enc
+    raise RuntimeError(f"无法读取 CSV 文件：{path} 不能用 {', '.join(ENCODING_CANDIDATES)} 中任何一种编码解码")
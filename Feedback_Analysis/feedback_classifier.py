@@ -17,19 +17,69 @@ CSV 反馈模块标注脚本（规则匹配+大模型补全）
 from __future__ import annotations
 
 import argparse
+import asyncio
+import codecs
 import os
 import csv
 import json
-import requests
-from typing import List, Dict, Any, Tuple
+import random
+import re
+from functools import lru_cache
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Dict, Any, Tuple
 
+import httpx
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+try:
+    import ahocorasick
+except ImportError:  # 未安装 pyahocorasick 时退回正则匹配
+    ahocorasick = None
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时退回标准库 json
+    orjson = None
+
+from csv_encoding import resolve_encoding
+from llm_cache import LLMCache, SemanticCache, make_key, make_namespace
+
+# 系统提示词必须逐字节保持不变：服务端的前缀缓存只对完全相同的前缀生效
+SYSTEM_PROMPT = (
+    "作为学习App用户反馈分类员，任务是用户反馈，将其准确归类至以下标签中的一个如果包含多个就要选择多个回复。请注意，将仅返回与用户反馈内容匹配的标签，思考内容不要展示，不做任何额外回复。标签包含：\n"
+    "【学伴】涉及成长陪伴、元气值、升级石等相关反馈\n"
+    "【卡顿】针对使用过程中出现卡顿、延迟等体验问题\n"
+    "【抽卡】涵盖SSR、SR、卡包等游戏化激励模块的反馈\n"
+    "【VIP】任何与充值、会员服务相关的意见或问题\n"
+    "【奖学金】与学习奖励获取、兑换资格等相关的内容\n"
+    "【排行榜】包括学力值日榜、省份月榜等排名相关反馈\n"
+    "【兑换商店】涉及奖学金兑换、周边商品、发货延迟等事务\n"
+    "【我的】中心功能、个人信息管理等相关反馈\n"
+    "【欧粉说】社区发帖、互动、内容相关的建议或问题\n"
+    "【签到】每周打卡功能、奖励领取异常等反馈\n"
+    "【教材】一些新科目的缺少，现已有教材的版本问题\n"
+)
+
+def json_dumps(obj: Any) -> bytes:
+    """序列化为 UTF-8 JSON 字节串"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+def json_loads(data: str | bytes) -> Any:
+    """解析 JSON；解析失败统一抛出 json.JSONDecodeError（orjson 的异常是其子类）"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
 def load_config(config_path: str = "config.json") -> Dict[str, Any]:
     """加载配置文件"""
     try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(config_path, 'rb') as f:
+            return json_loads(f.read())
     except FileNotFoundError:
         print(f"配置文件 {config_path} 未找到，使用默认配置")
         return {
@@ -41,20 +91,7 @@ def load_config(config_path: str = "config.json") -> Dict[str, Any]:
                     "max_tokens": 100,
                     "temperature": 0.7,
                     "top_k": 2,
-                    "system_prompt": (
-                        "作为学习App用户反馈分类员，任务是用户反馈，将其准确归类至以下标签中的一个如果包含多个就要选择多个回复。请注意，将仅返回与用户反馈内容匹配的标签，思考内容不要展示，不做任何额外回复。标签包含：\n"
-                        "【学伴】涉及成长陪伴、元气值、升级石等相关反馈\n"
-                        "【卡顿】针对使用过程中出现卡顿、延迟等体验问题\n"
-                        "【抽卡】涵盖SSR、SR、卡包等游戏化激励模块的反馈\n"
-                        "【VIP】任何与充值、会员服务相关的意见或问题\n"
-                        "【奖学金】与学习奖励获取、兑换资格等相关的内容\n"
-                        "【排行榜】包括学力值日榜、省份月榜等排名相关反馈\n"
-                        "【兑换商店】涉及奖学金兑换、周边商品、发货延迟等事务\n"
-                        "【我的】中心功能、个人信息管理等相关反馈\n"
-                        "【欧粉说】社区发帖、互动、内容相关的建议或问题\n"
-                        "【签到】每周打卡功能、奖励领取异常等反馈\n"
-                        "【教材】一些新科目的缺少，现已有教材的版本问题\n"
-                    )
+                    "system_prompt": SYSTEM_PROMPT
                 }
             },
             "rules": []
@@ -67,36 +104,120 @@ def get_api_key(config: Dict[str, Any]) -> str:
         api_key = config.get("api", {}).get("spark", {}).get("api_key", '')
     return api_key
 
-def call_spark_api(user_content: str, config: Dict[str, Any]) -> str:
-    """调用讯飞星火API"""
+def make_async_client(max_connections: int = 64) -> httpx.AsyncClient:
+    """创建 HTTP/2 异步客户端，所有请求在同一 TLS 连接上多路复用"""
+    return httpx.AsyncClient(http2=True, timeout=30, limits=httpx.Limits(max_connections=max_connections))
+
+class AdaptiveLimiter:
+    """
+    自适应并发控制（AIMD）：遇到 429/5xx 或网络错误时并发减半，每连续成功 increase_every 次恢复 1 个并发；
+    响应头给出 x-ratelimit-remaining-requests 时，提前把在途请求数压到剩余额度以内。
+    """
+
+    def __init__(self, max_limit: int, increase_every: int = 10) -> None:
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self.increase_every = increase_every
+        self.in_flight = 0
+        self.remaining: int | None = None
+        self._successes = 0
+        self._cond = asyncio.Condition()
+
+    def _capacity(self) -> int:
+        if self.remaining is None:
+            return self.limit
+        # 额度耗尽时仍放行 1 个请求，由其 429 触发退避，避免全部挂起
+        return min(self.limit, max(1, self.remaining))
+
+    async def acquire(self) -> None:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self._capacity())
+            self.in_flight += 1
+
+    async def release(self, throttled: bool, remaining: str | None = None) -> None:
+        async with self._cond:
+            self.in_flight -= 1
+            if remaining is not None and remaining.strip().isdigit():
+                self.remaining = int(remaining)
+            if throttled:
+                self._successes = 0
+                if self.limit > 1:
+                    self.limit = max(1, self.limit // 2)
+                    print(f"触发限流，并发降为 {self.limit}")
+            else:
+                self._successes += 1
+                if self._successes >= self.increase_every and self.limit < self.max_limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+def is_retryable_status(status: int) -> bool:
+    """429 与 5xx 视为限流/服务端过载，可退避重试"""
+    return status == 429 or status >= 500
+
+async def _post_spark(
+    client: httpx.AsyncClient, url: str, headers: Dict[str, str], body: bytes, stream: bool
+) -> Tuple[int, str | None, str]:
+    """发送一次请求（body 为已序列化的 JSON），返回 (状态码, 剩余请求额度响应头, 文本)；状态码非 2xx 时文本为空"""
+    if not stream:
+        response = await client.post(url, headers=headers, content=body)
+        remaining = response.headers.get("x-ratelimit-remaining-requests")
+        if response.status_code >= 400:
+            return response.status_code, remaining, ""
+        return response.status_code, remaining, (json_loads(response.content)["choices"][0]["message"].get("content") or "").strip()
+
+    async with client.stream("POST", url, headers=headers, content=body) as response:
+        remaining = response.headers.get("x-ratelimit-remaining-requests")
+        if response.status_code >= 400:
+            return response.status_code, remaining, ""
+        
+        full_response = ""
+        async for line in response.aiter_lines():
+            if line:
+                try:
+                    if line.startswith('data: '):
+                        line = line[6:]
+                    
+                    if line.strip() == '[DONE]':
+                        break
+                    
+                    json_data = json_loads(line)
+                    if 'choices' in json_data and len(json_data['choices']) > 0:
+                        delta = json_data['choices'][0].get('delta', {})
+                        content = delta.get('content', '')
+                        if content:
+                            full_response += content
+                except json.JSONDecodeError:
+                    pass
+    
+    return response.status_code, remaining, full_response.strip()
+
+async def _request_spark(
+    client: httpx.AsyncClient,
+    system_prompt: str,
+    user_content: str,
+    config: Dict[str, Any],
+    max_tokens: int,
+    limiter: AdaptiveLimiter | None = None,
+) -> str:
+    """
+    发送一次讯飞星火请求并返回原始文本。
+    分类只输出几个 token，默认不开流式，整段响应一次解析；api.spark.stream 为真时按 SSE 逐块拼接。
+    遇到 429/5xx 或网络错误时按指数退避加随机抖动重试，最多 api.spark.max_retries 次（默认3）；
+    传入 limiter 时每次尝试都占用一个并发名额，并把限流信号反馈给它。
+    """
     api_config = config.get("api", {}).get("spark", {})
+    stream = bool(api_config.get("stream", False))
+    max_retries = int(api_config.get("max_retries", 3))
     url = api_config.get("api_url", "https://spark-api-open.xf-yun.com/v2/chat/completions")
     api_key = get_api_key(config)
     
     if not api_key:
         print("错误：未配置API密钥")
         return ""
-    
-    system_prompt = api_config.get(
-        "system_prompt",
-        (
-            "作为学习App用户反馈分类员，任务是用户反馈，将其准确归类至以下标签中的一个如果包含多个就要选择多个回复。请注意，将仅返回与用户反馈内容匹配的标签，思考内容不要展示，不做任何额外回复。标签包含：\n"
-            "【学伴】涉及成长陪伴、元气值、升级石等相关反馈\n"
-            "【卡顿】针对使用过程中出现卡顿、延迟等体验问题\n"
-            "【抽卡】涵盖SSR、SR、卡包等游戏化激励模块的反馈\n"
-            "【VIP】任何与充值、会员服务相关的意见或问题\n"
-            "【奖学金】与学习奖励获取、兑换资格等相关的内容\n"
-            "【排行榜】包括学力值日榜、省份月榜等排名相关反馈\n"
-            "【兑换商店】涉及奖学金兑换、周边商品、发货延迟等事务\n"
-            "【我的】中心功能、个人信息管理等相关反馈\n"
-            "【欧粉说】社区发帖、互动、内容相关的建议或问题\n"
-            "【签到】每周打卡功能、奖励领取异常等反馈\n"
-            "【教材】一些新科目的缺少，现已有教材的版本问题\n"
-        ),
-    )
 
     data = {
-        "max_tokens": api_config.get("max_tokens", 100),
+        "max_tokens": max_tokens,
         "top_k": api_config.get("top_k", 2),
         "temperature": api_config.get("temperature", 0.7),
         "messages": [
@@ -110,43 +231,167 @@ def call_spark_api(user_content: str, config: Dict[str, Any]) -> str:
             }
         ],
         "model": api_config.get("model", "x1"),
-        "stream": True
+        "stream": stream
     }
     
     headers = {
         "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
+        "Content-Type": "application/json",
+        "Accept-Encoding": "gzip",
     }
+    # 重试时复用同一份请求体，只序列化一次
+    body = json_dumps(data)
     
-    try:
-        response = requests.post(url, headers=headers, json=data, stream=True, timeout=30)
-        response.raise_for_status()
-        
-        full_response = ""
-        for line in response.iter_lines():
-            if line:
-                line = line.decode('utf-8')
-                try:
-                    if line.startswith('data: '):
-                        line = line[6:]
-                    
-                    if line.strip() == '[DONE]':
-                        break
-                    
-                    json_data = json.loads(line)
-                    if 'choices' in json_data and len(json_data['choices']) > 0:
-                        delta = json_data['choices'][0].get('delta', {})
-                        content = delta.get('content', '')
-                        if content:
-                            full_response += content
-                except json.JSONDecodeError:
-                    pass
-        
-        return full_response.strip()
-        
-    except requests.exceptions.RequestException as e:
-        print(f"API调用失败: {e}")
-        return ""
+    last_error = ""
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            await asyncio.sleep(random.uniform(0, 2 ** attempt))
+        if limiter is not None:
+            await limiter.acquire()
+
+        status: int | None = None
+        remaining: str | None = None
+        transport_error = False
+        try:
+            status, remaining, text = await _post_spark(client, url, headers, body, stream)
+        except httpx.HTTPError as e:
+            # 超时、连接被重置多是服务端过载的表现，与 429 一样触发降并发
+            transport_error = True
+            last_error = str(e)
+        except (ValueError, KeyError, IndexError) as e:
+            print(f"API响应解析失败: {e}")
+            return ""
+        finally:
+            if limiter is not None:
+                await limiter.release(
+                    throttled=transport_error or (status is not None and is_retryable_status(status)),
+                    remaining=remaining,
+                )
+
+        if status is None:
+            continue
+        if status < 400:
+            return text
+        last_error = f"HTTP {status}"
+        if not is_retryable_status(status):
+            break
+
+    print(f"API调用失败: {last_error}")
+    return ""
+
+def get_system_prompt(config: Dict[str, Any]) -> str:
+    """
+    获取系统提示词：配置中的 system_prompt，缺省为 SYSTEM_PROMPT；
+    api.spark.short_prompt 为真时换成只列标签名的精简版。
+    """
+    api_config = config.get("api", {}).get("spark", {})
+    system_prompt = api_config.get("system_prompt", SYSTEM_PROMPT)
+    if api_config.get("short_prompt"):
+        return build_short_prompt(system_prompt)
+    return system_prompt
+
+@lru_cache(maxsize=None)
+def build_short_prompt(system_prompt: str) -> str:
+    """从完整提示词中提取【标签】，生成只含标签清单的精简提示词"""
+    labels = list(dict.fromkeys(re.findall(r"【([^】]+)】", system_prompt)))
+    if not labels:
+        return system_prompt
+    return (
+        "将用户反馈归类到以下标签，可多选，仅输出【标签】，不做任何额外回复。标签："
+        + "".join(f"【{label}】" for label in labels)
+        + "\n"
+    )
+
+async def call_spark_api_async(
+    client: httpx.AsyncClient,
+    user_content: str,
+    config: Dict[str, Any],
+    limiter: AdaptiveLimiter | None = None,
+) -> str:
+    """调用讯飞星火API（异步）"""
+    api_config = config.get("api", {}).get("spark", {})
+    return await _request_spark(
+        client,
+        get_system_prompt(config),
+        user_content,
+        config,
+        max_tokens=api_config.get("max_tokens", 100),
+        limiter=limiter,
+    )
+
+def call_spark_api(user_content: str, config: Dict[str, Any]) -> str:
+    """
+    调用讯飞星火API。
+    每次请求的系统提示词都是同一个字符串（批量请求只在其后追加固定的 BATCH_INSTRUCTION），
+    保证各请求前缀逐字节相同，以便命中服务端的前缀缓存；修改提示词时不要引入随请求变化的内容。
+    """
+    async def run() -> str:
+        async with make_async_client() as client:
+            return await call_spark_api_async(client, user_content, config)
+    return asyncio.run(run())
+
+BATCH_INSTRUCTION = (
+    "\n用户会一次给出多条带编号的反馈，请对每条按顺序每行输出一个【标签】，"
+    "格式为“编号) 【标签】”，不要遗漏、合并或调换顺序。\n"
+)
+
+BATCH_LINE_PATTERN = re.compile(r'^\s*(\d+)[\).:：、．\s]')
+
+async def call_spark_api_batch_async(
+    client: httpx.AsyncClient,
+    texts: List[str],
+    config: Dict[str, Any],
+    limiter: AdaptiveLimiter | None = None,
+) -> List[str]:
+    """
+    将多条反馈编号拼成一次请求调用讯飞星火API，按编号拆回各条的后处理结果。
+    请求本身失败（未配置密钥、4xx 或重试耗尽）时整批返回空标签；
+    只有拿到回复但缺少部分编号时，缺失的条目才回退为单条调用。
+    """
+    if not texts:
+        return []
+    if len(texts) == 1:
+        return [postprocess_llm_output(await call_spark_api_async(client, texts[0], config, limiter))]
+
+    api_config = config.get("api", {}).get("spark", {})
+    # 反馈内容自身的换行会打乱编号，拼接前压成单行
+    user_content = "\n".join(f"{i+1}) {' '.join(t.split())}" for i, t in enumerate(texts))
+    raw = await _request_spark(
+        client,
+        get_system_prompt(config) + BATCH_INSTRUCTION,
+        user_content,
+        config,
+        # 每条都需要输出一个标签，token 上限按条数放大
+        max_tokens=api_config.get("max_tokens", 100) * len(texts),
+        limiter=limiter,
+    )
+    if not raw:
+        return [""] * len(texts)
+
+    responses = pd.Series([""] * len(texts), dtype=object)
+    found = [False] * len(texts)
+    for line in raw.splitlines():
+        m = BATCH_LINE_PATTERN.match(line)
+        if not m:
+            continue
+        number = int(m.group(1))
+        if 1 <= number <= len(texts) and not found[number - 1]:
+            found[number - 1] = True
+            responses[number - 1] = line[m.end():]
+
+    results = postprocess_llm_outputs(responses)
+    missing = [i for i, processed in enumerate(results) if not processed]
+    if missing:
+        retried = await asyncio.gather(*(call_spark_api_async(client, texts[i], config, limiter) for i in missing))
+        results[missing] = postprocess_llm_outputs(pd.Series(retried, index=missing, dtype=object))
+    return results.tolist()
+
+def call_spark_api_batch(texts: List[str], config: Dict[str, Any]) -> List[str]:
+    """批量调用讯飞星火API"""
+    async def run() -> List[str]:
+        async with make_async_client() as client:
+            return await call_spark_api_batch_async(client, texts, config)
+    return asyncio.run(run())
 
 def extract_text_inside_brackets(text: str) -> str | None:
     """提取【】中的内容；若不存在则返回None"""
@@ -159,6 +404,8 @@ def extract_text_inside_brackets(text: str) -> str | None:
         return inner if inner else None
     return None
 
+SENSITIVE_PHRASE = "使用粗鲁、不礼貌和侮辱性的语言是不恰当的"
+
 def postprocess_llm_output(raw_output: str) -> str:
     """
     后处理大模型输出：
@@ -168,21 +415,193 @@ def postprocess_llm_output(raw_output: str) -> str:
     if not raw_output:
         return ""
     normalized = str(raw_output).strip()
-    if "使用粗鲁、不礼貌和侮辱性的语言是不恰当的" in normalized:
+    if SENSITIVE_PHRASE in normalized:
         return "其他："
     inner = extract_text_inside_brackets(normalized)
     return inner if inner is not None else normalized
 
-def read_csv_auto(path: str) -> pd.DataFrame:
-    """读取CSV自动尝试多种编码"""
-    candidates = ["utf-8", "utf-8-sig", "gb18030", "gbk", "cp936"]
-    last_err: Exception | None = None
-    for enc in candidates:
-        try:
-            return pd.read_csv(path, encoding=enc)
-        except Exception as e:
-            last_err = e
-    raise last_err if last_err else RuntimeError("无法读取 CSV 文件：未知错误")
+def postprocess_llm_outputs(responses: pd.Series) -> pd.Series:
+    """postprocess_llm_output 的整列版本，用编译后的正则一次处理所有输出"""
+    normalized = responses.fillna("").astype(str).str.strip()
+    sens = normalized.str.contains(SENSITIVE_PHRASE, regex=False)
+    # 与 extract_text_inside_brackets 一致：只看第一个【及其后第一个】
+    inner = normalized.str.extract(r'^[^【]*【([^】]+)】', expand=False).str.strip()
+    inner = inner.where(inner.notna() & (inner != ""), normalized)
+    return pd.Series(np.where(sens, "其他：", inner), index=responses.index, dtype=object)
+
+def iter_csv_chunks(path: str, chunksize: int = 50_000) -> Iterator[pd.DataFrame]:
+    """
+    按块读取CSV，内存占用与文件大小无关。编码在读取前对全文验证一次，不会读到中途才解码失败；
+    所有列按文本读取，避免各块独立推断出不同类型（如整数列在某块中因空值变为浮点）。
+    """
+    enc = resolve_encoding(path)
+    # PyArrow 引擎不支持 chunksize，分块读取使用 C 引擎
+    yield from pd.read_csv(path, encoding=enc, chunksize=max(1, chunksize), dtype=str)
+
+def normalize_rules(rules: List[Dict[str, Any]]) -> List[Tuple[str, Tuple[str, ...]]]:
+    """规则预处理：去除标签与关键词首尾空白，丢弃空关键词"""
+    rules_norm: List[Tuple[str, Tuple[str, ...]]] = []
+    for rule in rules:
+        keywords = tuple(str(kw).strip() for kw in rule.get("keywords", []) or [])
+        rules_norm.append((str(rule.get("label", "")).strip(), tuple(kw for kw in keywords if kw)))
+    return rules_norm
+
+def build_keyword_index(rules: List[Dict[str, Any]]) -> Tuple[List[str], Dict[str, List[int]]]:
+    """建立关键词索引：返回 标签列表 与 关键词 -> 所属规则序号列表"""
+    rules_norm = normalize_rules(rules)
+    kw_rules: Dict[str, List[int]] = {}
+    for rule_idx, (_, kws) in enumerate(rules_norm):
+        for kw in dict.fromkeys(kws):
+            kw_rules.setdefault(kw, []).append(rule_idx)
+    return [label for label, _ in rules_norm], kw_rules
+
+def resolve_hits(hit_rules: set[int], labels: List[str], strategy: str) -> str | None:
+    """按规则顺序把命中的规则序号转为标签：first 取第一条，all 合并去重"""
+    if not hit_rules:
+        return None
+    if strategy == "first":
+        return labels[min(hit_rules)]
+    return ",".join(dict.fromkeys(labels[i] for i in sorted(hit_rules)))
+
+def match_rules_automaton(texts: List[str], rules: List[Dict[str, Any]], strategy: str = "first") -> List[str | None]:
+    """用 Aho-Corasick 自动机一次扫描匹配所有关键词，结果与逐条规则匹配一致"""
+    labels, kw_rules = build_keyword_index(rules)
+    if not kw_rules:
+        return [None] * len(texts)
+
+    automaton = ahocorasick.Automaton()
+    for kw_str, rule_idxs in kw_rules.items():
+        automaton.add_word(kw_str, tuple(rule_idxs))
+    automaton.make_automaton()
+
+    mapped: List[str | None] = []
+    for text in texts:
+        hit_rules: set[int] = set()
+        for _, rule_idxs in automaton.iter(text):
+            hit_rules.update(rule_idxs)
+            # 第一条规则已命中，first 策略无需继续扫描
+            if strategy == "first" and 0 in hit_rules:
+                break
+        mapped.append(resolve_hits(hit_rules, labels, strategy))
+    return mapped
+
+def match_rules_regex(texts: List[str], rules: List[Dict[str, Any]], strategy: str = "first") -> List[str | None]:
+    """
+    把所有关键词编译为一个正则一次扫描，结果与逐条规则匹配一致。
+    零宽前瞻使每个位置都参与匹配；同一位置按长度优先取最长关键词，
+    其前缀关键词所属规则预先并入，避免重叠关键词漏命中。
+    """
+    labels, kw_rules = build_keyword_index(rules)
+    if not kw_rules:
+        return [None] * len(texts)
+
+    keywords = sorted(kw_rules, key=len, reverse=True)
+    pattern = re.compile("(?=(" + "|".join(re.escape(k) for k in keywords) + "))")
+    closure = {
+        kw: frozenset(i for other in keywords if kw.startswith(other) for i in kw_rules[other])
+        for kw in keywords
+    }
+
+    mapped: List[str | None] = []
+    for text in texts:
+        hit_rules: set[int] = set()
+        for m in pattern.finditer(text):
+            hit_rules.update(closure[m.group(1)])
+        mapped.append(resolve_hits(hit_rules, labels, strategy))
+    return mapped
+
+def match_rules_python(texts: List[str], rules: List[Dict[str, Any]], strategy: str = "first") -> List[str | None]:
+    """
+    逐条规则做子串匹配；规则在循环外预处理一次。
+    先用包含全部关键词的正则在整列上筛出可能命中的行，逐条规则的比较只在这些行上进行。
+    """
+    rules_norm = normalize_rules(rules)
+    all_keywords = list(dict.fromkeys(kw for _, kws in rules_norm for kw in kws))
+    if not all_keywords:
+        return [None] * len(texts)
+    any_pat = re.compile("|".join(re.escape(kw) for kw in all_keywords))
+    candidates = np.flatnonzero(pd.Series(texts, dtype=object).str.contains(any_pat, regex=True).to_numpy(dtype=bool))
+
+    def map_text_to_label(source_text: str) -> str | None:
+        hits: List[str] = []
+        for label, kws in rules_norm:
+            for kw in kws:
+                if kw in source_text:
+                    hits.append(label)
+                    break
+            if strategy == "first" and hits:
+                return hits[0]
+        if strategy == "all":
+            unique_hits = list(dict.fromkeys(hits))
+            return ",".join(unique_hits) if unique_hits else None
+        return None
+
+    mapped: List[str | None] = [None] * len(texts)
+    for i in candidates:
+        mapped[i] = map_text_to_label(texts[i])
+    return mapped
+
+@lru_cache(maxsize=1)
+def _numba_scan_kernel() -> Callable[..., Any]:
+    """编译 numba 子串扫描内核（首次调用时导入 numba 并 JIT 编译一次）"""
+    try:
+        from numba import njit, prange
+    except ImportError:
+        raise RuntimeError("需要 numba 才能使用并行子串扫描，请先运行: pip install numba")
+
+    @njit(parallel=True, cache=True)
+    def scan(buf, offsets, kw_buf, kw_offsets, kw_rule, n_rules):
+        n_texts = offsets.shape[0] - 1
+        hits = np.zeros((n_texts, n_rules), dtype=np.bool_)
+        for i in prange(n_texts):
+            start, end = offsets[i], offsets[i + 1]
+            for k in range(kw_offsets.shape[0] - 1):
+                rule = kw_rule[k]
+                if hits[i, rule]:
+                    continue
+                kw_start = kw_offsets[k]
+                kw_len = kw_offsets[k + 1] - kw_start
+                for pos in range(start, end - kw_len + 1):
+                    found = True
+                    for j in range(kw_len):
+                        if buf[pos + j] != kw_buf[kw_start + j]:
+                            found = False
+                            break
+                    if found:
+                        hits[i, rule] = True
+                        break
+        return hits
+
+    return scan
+
+def _pack_utf8(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """把字符串编码为 UTF-8 并拼接成一个 uint8 缓冲区，返回 (缓冲区, 偏移量)"""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+def match_rules_numba(texts: List[str], rules: List[Dict[str, Any]], strategy: str = "first") -> List[str | None]:
+    """
+    用 numba 并行内核在 UTF-8 字节上逐关键词扫描，得到 文本 x 规则 的命中矩阵，结果与逐条规则匹配一致。
+    UTF-8 中字符串包含关系与字节串包含关系等价，因此无需解码。
+    """
+    labels, kw_rules = build_keyword_index(rules)
+    if not kw_rules or not texts:
+        return [None] * len(texts)
+
+    # 同一关键词属于多条规则时展开为多项
+    pairs = [(kw, rule_idx) for kw, rule_idxs in kw_rules.items() for rule_idx in rule_idxs]
+    kw_buf, kw_offsets = _pack_utf8([kw for kw, _ in pairs])
+    kw_rule = np.array([rule_idx for _, rule_idx in pairs], dtype=np.int64)
+    buf, offsets = _pack_utf8(texts)
+
+    hits = _numba_scan_kernel()(buf, offsets, kw_buf, kw_offsets, kw_rule, len(labels))
+
+    mapped: List[str | None] = [None] * len(texts)
+    for i in np.flatnonzero(hits.any(axis=1)):
+        mapped[i] = resolve_hits(set(np.flatnonzero(hits[i]).tolist()), labels, strategy)
+    return mapped
 
 def apply_rules(
     df: pd.DataFrame,
@@ -191,8 +610,12 @@ def apply_rules(
     module_col_index: int,
     strategy: str = "first",
     mode: str = "overwrite",
+    matcher: str = "auto",
 ) -> Tuple[pd.DataFrame, int]:
-    """应用规则匹配"""
+    """
+    应用规则匹配，直接替换 df 的模块列（原地修改）并返回 df 与命中条数。matcher 选择匹配实现：
+    ahocorasick=自动机；regex=单个正则；numba=并行字节扫描；python=逐条规则；auto=已安装 pyahocorasick 时用自动机，否则用正则
+    """
     if df is None or df.empty:
         return df, 0
 
@@ -203,38 +626,64 @@ def apply_rules(
     if df.shape[1] <= max_needed:
         raise IndexError(f"列数量不足：当前 {df.shape[1]} 列，但需要索引到 {max_needed+1} 列。")
 
-    match_count = 0
-    
-    def map_text_to_label(text: Any) -> Any:
-        nonlocal match_count
-        source_text = "" if pd.isna(text) else str(text)
-        hits: List[str] = []
-        for rule in rules:
-            label = str(rule.get("label", "")).strip()
-            for kw in rule.get("keywords", []) or []:
-                kw_str = str(kw).strip()
-                if kw_str and kw_str in source_text:
-                    hits.append(label)
-                    break
-            if strategy == "first" and hits:
-                match_count += 1
-                return hits[0]
-        if strategy == "all":
-            unique_hits = list(dict.fromkeys(hits))
-            if unique_hits:
-                match_count += 1
-            return ",".join(unique_hits) if unique_hits else None
-        return None
+    if matcher == "auto":
+        matcher = "ahocorasick" if ahocorasick is not None else "regex"
+    if matcher == "ahocorasick" and ahocorasick is None:
+        raise RuntimeError("需要 pyahocorasick 才能使用自动机匹配，请先运行: pip install pyahocorasick")
+
+    # 相同内容只匹配一次，再按 codes 广播回各行
+    codes, uniques = pd.factorize(df.iloc[:, content_idx0].fillna("").astype(str))
+    texts = list(uniques)
 
-    out = df.copy()
-    mapped = out.iloc[:, content_idx0].apply(map_text_to_label)
+    match_fn = {
+        "ahocorasick": match_rules_automaton,
+        "regex": match_rules_regex,
+        "numba": match_rules_numba,
+    }.get(matcher, match_rules_python)
+    mapped = match_fn(texts, rules, strategy)
+    mapped = np.array(mapped, dtype=object)[codes]
 
+    # 整列一次写回：overwrite 仅替换命中的行，append 以匹配结果为准
+    hit = np.array([m is not None for m in mapped], dtype=bool)
     if mode == "overwrite":
-        out.iloc[:, module_idx0] = mapped.where(~mapped.isna(), out.iloc[:, module_idx0])
+        col = df.iloc[:, module_idx0].to_numpy(dtype=object, copy=True)
     else:
-        out.iloc[:, module_idx0] = mapped
+        col = np.full(len(df), None, dtype=object)
+    col[hit] = mapped[hit]
 
-    return out, match_count
+    df.isetitem(module_idx0, col)
+    return df, int(hit.sum())
+
+def iter_batches(items: Iterable[int], size: int) -> Iterator[List[int]]:
+    """按固定大小切分序列"""
+    it = iter(items)
+    while True:
+        batch = list(islice(it, max(1, size)))
+        if not batch:
+            return
+        yield batch
+
+async def label_batches_async(
+    batches: List[List[int]],
+    texts: List[str],
+    config: Dict[str, Any],
+    concurrency: int,
+    on_batch_done: Callable[[List[int], List[str]], None],
+) -> None:
+    """在同一个 HTTP/2 客户端上并发请求各批次，并发上限为 concurrency，遇到限流时自适应下调"""
+    limiter = AdaptiveLimiter(concurrency)
+    total = sum(len(batch) for batch in batches)
+    done = 0
+
+    async with make_async_client(max_connections=max(1, concurrency)) as client:
+        async def label_batch(batch: List[int]) -> Tuple[List[int], List[str]]:
+            return batch, await call_spark_api_batch_async(client, [texts[u] for u in batch], config, limiter)
+
+        for next_done in asyncio.as_completed([label_batch(batch) for batch in batches]):
+            batch, labels = await next_done
+            on_batch_done(batch, labels)
+            done += len(batch)
+            print(f"大模型补全进度：{done}/{total}")
 
 def llm_fill_unmatched(
     df: pd.DataFrame,
@@ -242,50 +691,125 @@ def llm_fill_unmatched(
     module_col_index: int,
     config: Dict[str, Any],
     mode: str = "overwrite",
+    batch_size: int = 10,
+    concurrency: int = 16,
+    cache: LLMCache | None = None,
+    semantic_cache: SemanticCache | None = None,
 ) -> pd.DataFrame:
-    """使用大模型补全未匹配的内容"""
+    """
+    使用大模型补全未匹配的内容（原地修改 df 的模块列并返回 df），每 batch_size 条合并为一次请求，最多 concurrency 个请求并发。
+    传入 cache / semantic_cache 时依次查精确缓存与语义缓存，新结果写回缓存。
+    """
     if df is None or df.empty:
         return df
     
     content_idx0 = max(0, content_col_index - 1)
     module_idx0 = max(0, module_col_index - 1)
     
-    out = df.copy()
-    total_rows = len(out)
+    # 找出所有需要大模型补全的行索引：模块列为空且内容列非空
+    mod = df.iloc[:, module_idx0]
+    con = df.iloc[:, content_idx0]
+    mod_empty = mod.isna() | (mod.astype(str).str.strip() == "")
+    con_ok = con.notna() & (con.astype(str).str.strip() != "")
+    unmatched_indices = np.flatnonzero((mod_empty & con_ok).to_numpy(dtype=bool))
     
-    # 找出所有需要大模型补全的行索引
-    unmatched_indices = []
-    for i in range(total_rows):
-        module_value = out.iloc[i, module_idx0]
-        content_value = out.iloc[i, content_idx0]
-        if (pd.isna(module_value) or str(module_value).strip() == "") and \
-           (not pd.isna(content_value) and str(content_value).strip() != ""):
-            unmatched_indices.append(i)
-    
-    # 对未匹配的行进行大模型补全
-    if unmatched_indices:
-        print(f"开始大模型补全：共 {len(unmatched_indices)} 条需要补全")
-        for idx, row_idx in enumerate(unmatched_indices):
-            content_value = out.iloc[row_idx, content_idx0]
-            print(f"大模型补全进度：{idx+1}/{len(unmatched_indices)} - 处理第 {row_idx+1} 行")
-            
-            llm_result = call_spark_api(str(content_value), config)
-            processed = postprocess_llm_output(llm_result)
-            
-            if processed:
-                if mode == "overwrite":
-                    out.iloc[row_idx, module_idx0] = processed
-                else:
-                    current_value = out.iloc[row_idx, module_idx0]
-                    if pd.isna(current_value) or str(current_value).strip() == "":
-                        out.iloc[row_idx, module_idx0] = processed
-                    else:
-                        out.iloc[row_idx, module_idx0] = f"{current_value},{processed}"
+    if len(unmatched_indices) == 0:
+        return df
+
+    # 相同内容只请求一次，结果再按 codes 广播回各行；内容在主线程取出，工作线程不读写 DataFrame
+    codes, uniques = pd.factorize(con.to_numpy()[unmatched_indices].astype(str))
+    texts: List[str] = [str(t) for t in uniques]
+    labels_by_text = np.full(len(texts), "", dtype=object)
+    pending = list(range(len(texts)))
+    if len(texts) < len(unmatched_indices):
+        print(f"待补全 {len(unmatched_indices)} 行，去重后 {len(texts)} 条不同内容")
+
+    # 先查磁盘缓存，命中的内容无需调用API
+    keys: List[str] = []
+    if cache is not None:
+        model = config.get("api", {}).get("spark", {}).get("model", "x1")
+        system_prompt = get_system_prompt(config)
+        keys = [make_key(model, system_prompt, t) for t in texts]
+        cached = cache.get_many(keys)
+        hits = [u for u in pending if keys[u] in cached]
+        for u in hits:
+            labels_by_text[u] = cached[keys[u]]
+        if hits:
+            print(f"缓存命中 {len(hits)} 条")
+        pending = [u for u in pending if keys[u] not in cached]
+
+    # 再查语义缓存，相似表述直接复用已有标签
+    emb_by_text: Dict[int, Any] = {}
+    if semantic_cache is not None and pending:
+        embeddings = semantic_cache.encode([texts[u] for u in pending])
+        emb_by_text = dict(zip(pending, embeddings))
+        similar = semantic_cache.search(embeddings)
+        hits = [u for u, label in zip(pending, similar) if label]
+        for u, label in zip(pending, similar):
+            if label:
+                labels_by_text[u] = label
+        if hits:
+            print(f"语义缓存命中 {len(hits)} 条")
+        pending = [u for u, label in zip(pending, similar) if not label]
+
+    # 对剩余内容按批次并发进行大模型补全
+    if pending:
+        total = len(pending)
+        print(f"开始大模型补全：共 {total} 条需要补全，每批 {batch_size} 条，并发 {concurrency}")
+        batches = list(iter_batches(pending, batch_size))
+
+        def on_batch_done(batch: List[int], labels: List[str]) -> None:
+            labels_by_text[batch] = labels
+            new = [(u, label) for u, label in zip(batch, labels) if label]
+            if cache is not None:
+                cache.set_many([(keys[u], label) for u, label in new])
+            if semantic_cache is not None and new:
+                semantic_cache.add(
+                    np.stack([emb_by_text[u] for u, _ in new]),
+                    [label for _, label in new],
+                )
+
+        asyncio.run(label_batches_async(batches, texts, config, concurrency, on_batch_done))
+
+    # 待补全行的模块列均为空，overwrite 与 append 的结果一致；整列一次写回
+    row_labels = labels_by_text[codes]
+    filled = row_labels != ""
+    if filled.any():
+        col = df.iloc[:, module_idx0].to_numpy(dtype=object, copy=True)
+        col[unmatched_indices[filled]] = row_labels[filled]
+        df.isetitem(module_idx0, col)
     
-    return out
+    return df
+
+def write_csv(
+    df: pd.DataFrame,
+    path: str,
+    sep: str = ",",
+    quote_opt: str = "all",
+    writer: str = "arrow",
+    append: bool = False,
+) -> None:
+    """
+    写入CSV文件（UTF-8 带 BOM）。append=True 时追加到已有文件末尾，不再写 BOM 与表头。
+    writer=arrow 时用 PyArrow 的 C++ 写出器，仅用于 quote=all；Arrow 的 needed 风格会给所有字符串加引号，
+    与 csv.QUOTE_MINIMAL 不一致，因此 quote=minimal/none 以及数据无法转为 Arrow 表时退回 pandas。
+    """
+    if writer == "arrow" and quote_opt.lower() == "all":
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            table = None
+        if table is not None:
+            with open(path, "ab" if append else "wb") as f:
+                if not append:
+                    f.write(codecs.BOM_UTF8)
+                pacsv.write_csv(
+                    table,
+                    f,
+                    pacsv.WriteOptions(include_header=not append, delimiter=sep, quoting_style="all_valid"),
+                )
+            return
 
-def write_csv(df: pd.DataFrame, path: str, sep: str = ",", quote_opt: str = "all") -> None:
-    """写入CSV文件"""
     quoting_map = {
         "all": csv.QUOTE_ALL,
         "minimal": csv.QUOTE_MINIMAL,
@@ -296,13 +820,40 @@ def write_csv(df: pd.DataFrame, path: str, sep: str = ",", quote_opt: str = "all
     
     df.to_csv(
         path,
+        mode="a" if append else "w",
+        header=not append,
         index=False,
-        encoding="utf-8-sig",
+        encoding="utf-8" if append else "utf-8-sig",
         sep=sep,
         quoting=quoting,
         escapechar=escapechar,
     )
 
+def open_cache(args: argparse.Namespace, config: Dict[str, Any]) -> LLMCache | None:
+    """按命令行参数打开缓存；采样温度较高时输出不稳定，不做缓存"""
+    if args.no_cache:
+        return None
+    temperature = config.get("api", {}).get("spark", {}).get("temperature", 0.7)
+    if temperature > 0.3:
+        print(f"采样温度 {temperature} > 0.3，不使用大模型结果缓存")
+        return None
+    return LLMCache(args.cache)
+
+def open_semantic_cache(args: argparse.Namespace, config: Dict[str, Any]) -> SemanticCache | None:
+    """按命令行参数打开语义缓存；与 --no-cache 相互独立，采样温度较高时同样不启用"""
+    if not args.semantic_cache:
+        return None
+    temperature = config.get("api", {}).get("spark", {}).get("temperature", 0.7)
+    if temperature > 0.3:
+        print(f"采样温度 {temperature} > 0.3，不使用语义缓存")
+        return None
+    model = config.get("api", {}).get("spark", {}).get("model", "x1")
+    return SemanticCache(
+        args.semantic_cache,
+        threshold=args.semantic_threshold,
+        namespace=make_namespace(model, get_system_prompt(config)),
+    )
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="CSV 反馈模块标注脚本（规则匹配+大模型补全）")
     parser.add_argument("--input", required=True, help="输入 CSV 路径")
@@ -313,10 +864,30 @@ def main() -> None:
                        help="匹配策略：first=命中第一条停止；all=合并所有命中")
     parser.add_argument("--mode", choices=["overwrite", "append"], default="append",
                        help="写入模式：overwrite=覆盖原值；append=在原值后追加")
+    parser.add_argument("--matcher", choices=["auto", "ahocorasick", "regex", "numba", "python"], default="auto",
+                       help="规则匹配实现：auto=优先自动机，未安装 pyahocorasick 时用正则（默认）；numba=并行字节扫描（需安装 numba）；python=逐条规则")
     parser.add_argument("--out-sep", default=",", help="输出分隔符，默认逗号")
     parser.add_argument("--quote", choices=["all", "minimal", "none"], default="all",
                        help="输出引号策略：all=全部加引号（默认）；minimal=按需；none=不加引号")
+    parser.add_argument("--writer", choices=["arrow", "pandas"], default="arrow",
+                       help="CSV 写出实现：arrow=PyArrow（默认，空值不加引号，仅用于 --quote all）；pandas=DataFrame.to_csv")
     parser.add_argument("--config", default="config.json", help="配置文件路径，默认config.json")
+    parser.add_argument("--chunksize", type=int, default=50_000,
+                       help="分块读取与处理的行数，默认50000；内存占用与块大小成正比")
+    parser.add_argument("--stream", action="store_true", help="以流式方式调用大模型（便于调试），默认一次性返回")
+    parser.add_argument("--short-prompt", action="store_true",
+                       help="只发送标签清单的精简系统提示词，减少每次请求的输入 token")
+    parser.add_argument("--batch-size", type=int, default=10,
+                       help="每次大模型请求合并的反馈条数，默认10；设为1则逐条请求")
+    parser.add_argument("--concurrency", type=int, default=16,
+                       help="大模型请求的最大并发数，默认16，遇到限流时自动下调；设为1则串行请求")
+    parser.add_argument("--cache", default="llm_cache.sqlite3",
+                       help="大模型结果缓存文件路径，默认llm_cache.sqlite3")
+    parser.add_argument("--no-cache", action="store_true", help="不使用大模型结果缓存")
+    parser.add_argument("--semantic-cache", metavar="INDEX_PATH",
+                       help="启用语义缓存并指定索引文件（如 cache.faiss），需安装 faiss 与 sentence-transformers")
+    parser.add_argument("--semantic-threshold", type=float, default=0.92,
+                       help="语义缓存命中所需的余弦相似度，默认0.92")
     
     args = parser.parse_args()
 
@@ -325,45 +896,78 @@ def main() -> None:
 
     # 加载配置
     config = load_config(args.config)
+    if args.stream:
+        config.setdefault("api", {}).setdefault("spark", {})["stream"] = True
+    if args.short_prompt:
+        config.setdefault("api", {}).setdefault("spark", {})["short_prompt"] = True
     
-    print(f"读取输入文件：{args.input}")
-    df = read_csv_auto(args.input)
-    total_rows = len(df)
-    print(f"输入文件共 {total_rows} 行数据")
-    
-    print("\n第一步：应用规则匹配...")
-    rule_matched_df, match_count = apply_rules(
-        df=df,
-        rules=config.get("rules", []),
-        content_col_index=args.content_col,
-        module_col_index=args.module_col,
-        strategy=args.strategy,
-        mode=args.mode,
-    )
-    
-    unmatched_count = total_rows - match_count
-    print(f"规则匹配完成：成功匹配 {match_count} 条，剩余 {unmatched_count} 条需要大模型标注")
-    
-    if unmatched_count > 0:
-        print("\n第二步：使用大模型补全未匹配内容...")
-        final_df = llm_fill_unmatched(
-            df=rule_matched_df,
+    # 创建输出目录
+    out_dir = os.path.dirname(os.path.abspath(args.output))
+    if out_dir and not os.path.exists(out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+
+    print(f"读取输入文件：{args.input}（每块 {args.chunksize} 行）")
+    total_rows = 0
+    total_matched = 0
+    cache: LLMCache | None = None
+    semantic_cache: SemanticCache | None = None
+    caches_opened = False
+    # 先写到临时文件，全部成功后再替换 --output，中途失败不会留下半份结果
+    tmp_output = args.output + ".tmp"
+
+    for chunk_no, chunk in enumerate(iter_csv_chunks(args.input, args.chunksize), start=1):
+        print(f"\n第 {chunk_no} 块：第 {total_rows + 1}~{total_rows + len(chunk)} 行")
+        total_rows += len(chunk)
+
+        print("第一步：应用规则匹配...")
+        chunk, match_count = apply_rules(
+            df=chunk,
+            rules=config.get("rules", []),
             content_col_index=args.content_col,
             module_col_index=args.module_col,
-            config=config,
+            strategy=args.strategy,
             mode=args.mode,
+            matcher=args.matcher,
         )
-    else:
-        print("所有内容已通过规则匹配完成，无需大模型补全")
-        final_df = rule_matched_df
+        total_matched += match_count
 
-    # 创建输出目录
-    out_dir = os.path.dirname(os.path.abspath(args.output))
-    if out_dir and not os.path.exists(out_dir):
-        os.makedirs(out_dir, exist_ok=True)
+        unmatched_count = len(chunk) - match_count
+        print(f"规则匹配完成：成功匹配 {match_count} 条，剩余 {unmatched_count} 条需要大模型标注")
+
+        if unmatched_count > 0:
+            print("第二步：使用大模型补全未匹配内容...")
+            if not caches_opened:
+                cache = open_cache(args, config)
+                semantic_cache = open_semantic_cache(args, config)
+                caches_opened = True
+            chunk = llm_fill_unmatched(
+                df=chunk,
+                content_col_index=args.content_col,
+                module_col_index=args.module_col,
+                config=config,
+                mode=args.mode,
+                batch_size=args.batch_size,
+                concurrency=args.concurrency,
+                cache=cache,
+                semantic_cache=semantic_cache,
+            )
+        else:
+            print("本块内容已全部通过规则匹配，无需大模型补全")
+
+        # 每块处理完立即追加写出，内存中只保留当前块
+        write_csv(
+            chunk, tmp_output, sep=args.out_sep, quote_opt=args.quote, writer=args.writer, append=chunk_no > 1
+        )
+
+    if os.path.exists(tmp_output):
+        os.replace(tmp_output, args.output)
+
+    if cache is not None:
+        cache.close()
+    if semantic_cache is not None:
+        semantic_cache.save()
 
-    print(f"\n写入输出文件：{args.output}")
-    write_csv(final_df, args.output, sep=args.out_sep, quote_opt=args.quote)
+    print(f"\n输入共 {total_rows} 行，规则匹配 {total_matched} 条，结果已写入：{args.output}")
     print("处理完成！")
 
 if __name__ == "__main__":
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+大模型结果缓存
+
+- LLMCache：SQLite 精确缓存，键为 sha256(model + "\x1f" + system_prompt + "\x1f" + content)，
+  值为后处理后的标签；相同反馈重复运行时直接命中，不再调用API
+- SemanticCache：句向量 + FAISS 近似缓存，复用相似表述（如“卡死了”与“太卡顿”）的标签；
+  索引按 model + sha256(system_prompt) 区分，提示词或模型变化后重建
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+def make_key(model: str, system_prompt: str, content: str) -> str:
+    """计算缓存键"""
+    return hashlib.sha256((model + "\x1f" + system_prompt + "\x1f" + content).encode("utf-8")).hexdigest()
+
+
+def make_namespace(model: str, system_prompt: str) -> str:
+    """计算语义缓存的命名空间：模型名 + 系统提示词摘要"""
+    return model + ":" + hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """基于 SQLite 的标签缓存，可在多个线程间共享"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache(key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """批量查询，返回命中的 键 -> 标签"""
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, str] = {}
+        with self._lock:
+            # SQLite 默认单条语句最多 999 个参数
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM cache WHERE key IN ({placeholders})", part
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def set_many(self, items: List[Tuple[str, str]]) -> None:
+        """批量写入 键 -> 标签"""
+        if not items:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO cache(key, value) VALUES (?, ?)", items)
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class SemanticCache:
+    """
+    基于句向量的近似缓存：相似度不低于阈值的反馈直接复用已有标签。
+    索引持久化到 index_path，标签与 namespace、句向量模型名一起保存在同名 .labels.json 文件中；
+    二者与已有索引不一致时丢弃旧索引重新建立，避免复用其他提示词或模型得到的标签。
+    """
+
+    def __init__(
+        self,
+        index_path: str = "cache.faiss",
+        threshold: float = 0.92,
+        model_name: str = "paraphrase-multilingual-MiniLM-L12-v2",
+        namespace: str = "",
+    ) -> None:
+        try:
+            import faiss
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise RuntimeError("语义缓存需要 faiss 与 sentence-transformers，请先运行: pip install faiss-cpu sentence-transformers")
+
+        self._faiss = faiss
+        self.index_path = index_path
+        self.labels_path = index_path + ".labels.json"
+        self.threshold = threshold
+        self.model_name = model_name
+        self.namespace = namespace
+        self.model = SentenceTransformer(model_name)
+
+        meta: Dict[str, Any] = {}
+        if os.path.exists(self.index_path) and os.path.exists(self.labels_path):
+            with open(self.labels_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            # 旧版 sidecar 只是标签列表，没有 namespace，按不一致处理
+            if not isinstance(meta, dict):
+                meta = {}
+            if meta.get("namespace") != namespace or meta.get("model_name") != model_name:
+                print(f"语义缓存 {self.index_path} 由其他模型或系统提示词生成，重新建立索引")
+                meta = {}
+
+        if meta:
+            self.index = faiss.read_index(self.index_path)
+            self.labels: List[str] = list(meta.get("labels", []))
+        else:
+            self.index = faiss.IndexFlatIP(self.model.get_sentence_embedding_dimension())
+            self.labels = []
+
+    def encode(self, texts: List[str]) -> Any:
+        """批量编码为单位向量（内积即余弦相似度）"""
+        return self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype("float32")
+
+    def search(self, embeddings: Any) -> List[Optional[str]]:
+        """返回每条向量的命中标签；未达阈值为 None"""
+        if self.index.ntotal == 0 or len(embeddings) == 0:
+            return [None] * len(embeddings)
+        scores, ids = self.index.search(embeddings, 1)
+        return [
+            self.labels[i] if i >= 0 and score >= self.threshold else None
+            for score, i in zip(scores[:, 0], ids[:, 0])
+        ]
+
+    def add(self, embeddings: Any, labels: List[str]) -> None:
+        """加入新的 向量 -> 标签"""
+        if len(labels) == 0:
+            return
+        self.index.add(embeddings)
+        self.labels.extend(labels)
+
+    def save(self) -> None:
+        self._faiss.write_index(self.index, self.index_path)
+        with open(self.labels_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"namespace": self.namespace, "model_name": self.model_name, "labels": self.labels},
+                f,
+                ensure_ascii=False,
+            )
@@ -17,22 +17,22 @@
 import argparse
 import os
 import webbrowser
-from typing import Optional, List
+from typing import Optional
 
 import pandas as pd
+import pyarrow as pa
 
-# 尝试多种常见编码读取
-ENCODING_CANDIDATES: List[str] = ["utf-8", "utf-8-sig", "gb18030", "gbk", "cp936"]
+from csv_encoding import resolve_encoding
 
 
 def read_csv_auto(path: str) -> pd.DataFrame:
-    last_err: Exception | None = None
-    for enc in ENCODING_CANDIDATES:
-        try:
-            return pd.read_csv(path, encoding=enc)
-        except Exception as e:
-            last_err = e
-    raise last_err if last_err else RuntimeError("无法读取 CSV 文件：未知错误")
+    # 编码只检测并流式验证一次；优先用 PyArrow 引擎读为 Arrow 列，时间分箱与计数都在 C++ 中完成，
+    # 遇到不规则行等 PyArrow 无法解析的情况再用 C 引擎读一次
+    enc = resolve_encoding(path)
+    try:
+        return pd.read_csv(path, encoding=enc, engine="pyarrow", dtype_backend="pyarrow")
+    except (pd.errors.ParserError, pa.ArrowInvalid):
+        return pd.read_csv(path, encoding=enc)
 
 
 def parse_args() -> argparse.Namespace:
@@ -74,11 +74,12 @@ def plot_interactive(
         print("警告：所选时间范围内无数据，跳过出图")
         return
 
-    df = df.copy()
-    df["time_bin"] = df["__dt__"].dt.floor(freq)
-
     pivot = (
-        df.groupby(["time_bin", "__module__"]).size().reset_index(name="count")
+        df.assign(time_bin=df["__dt__"].dt.floor(freq))
+        .value_counts(["time_bin", "__module__"])
+        .rename("count")
+        .sort_index()
+        .reset_index()
     )
 
     fig = px.line(
@@ -118,11 +119,10 @@ def main() -> None:
             f"列数量不足：当前 {df.shape[1]} 列，需至少包含第{args.module_col}和第{args.time_col}列"
         )
 
-    modules = df.iloc[:, mod_idx0]
+    modules = df.iloc[:, mod_idx0].astype("string[pyarrow]")
     times = pd.to_datetime(df.iloc[:, time_idx0], errors="coerce")
 
-    mask = times.notna() & modules.notna()
-    data = pd.DataFrame({"__module__": modules[mask].astype(str), "__dt__": times[mask]})
+    data = pd.DataFrame({"__module__": modules, "__dt__": times}).dropna()
 
     if data.empty:
         print("无有效数据可统计（时间或模块为空）")